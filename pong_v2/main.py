@@ -1,5 +1,6 @@
+import time
+
 import pygame
-import pygame.locals
 
 
 class Board(object):
@@ -14,21 +15,33 @@ class Board(object):
         :param width:
         :param height:
         """
+        self.width, self.height = width, height
         self.surface = pygame.display.set_mode((width, height), 0, 32)
+        self.rect = self.surface.get_rect()
         pygame.display.set_caption("Ping Pong")
+        self.background = (0, 0, 0)
+        self.surface.fill(self.background)
+        # The whole window has to be pushed out on the first frame.
+        self._prev_rects = [self.rect.copy()]
 
     def draw(self, *args):
         """
-        Draws the game window.
+        Draws the game window. Only the areas covered by the objects in this
+        and the previous frame are cleared and sent to the display.
         
         :param args: list of objects to be drawn
         """
-        background = (0, 0, 0)
-        self.surface.fill(background)
+        for rect in self._prev_rects:
+            self.surface.fill(self.background, rect)
+
+        pairs = [drawable.blit_pair for drawable in args if isinstance(drawable, Drawable)]
+        rects = self.surface.blits(pairs)
         for drawable in args:
-            drawable.draw_on(self.surface)
+            if not isinstance(drawable, Drawable):
+                rects.extend(drawable.draw_on(self.surface))
 
-        pygame.display.update()
+        pygame.display.update(self._prev_rects + rects)
+        self._prev_rects = rects
 
 
 class PongGame(object):
@@ -36,34 +49,80 @@ class PongGame(object):
     It brings all  the elements of the game together.
     """
 
+    # Fixed physics time step, speeds are given in pixels per step.
+    PHYSICS_DT = 1 / 30
+    # Limit of steps run in one frame, so a long stall does not snowball.
+    MAX_STEPS = 5
+
+    # Change of the player's racket speed while the key is held down.
+    KEY_DELTA = {pygame.K_DOWN: 7, pygame.K_UP: -7}
+
     def __init__(self, width, height):
         pygame.init()
         self.board = Board(width, height)
+        # Let SDL drop everything else (e.g. mouse motion) before it reaches Python.
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.KEYUP])
+        # The filter does not touch events queued by init and set_mode.
+        pygame.event.clear()
 
         self.fps_clock = pygame.time.Clock()
-        self.ball = Ball(20, 20, width/2, height/2)
-        self.player1 = Racket(width=10, height=80, x=0, y=height/2)
-        self.player2 = Racket(width=10, height=80, x=width - 20, y= height/2, max_speed=10)
-        self.ai = Ai(self.player2, self.ball)
+        self.ball = Ball(self.board, 20, 20, width//2, height//2)
+        self.player1 = Racket(self.board, width=10, height=80, x=0, y=height//2)
+        self.player2 = Racket(self.board, width=10, height=80, x=width - 20, y= height//2, max_speed=10)
+        self.rackets = (self.player1, self.player2)
+        self.ai = Ai(self.board, self.player2, self.ball)
         self.judge = Judge(self.board, self.ball, self.player2)
 
+        self.grid = SpatialHash(max(self.player1.height, self.ball.height) * 2)
+        for index, racket in enumerate(self.rackets):
+            self.grid.add(index, racket.rect)
+
     def run(self):
         """
-        The main program loop.
+        The main program loop. Physics runs in fixed steps driven by the
+        elapsed time, independent of how often a frame is drawn.
         """
-        print(not self.handle_events())
+        previous = time.monotonic()
+        accumulator = 0.0
         while not self.handle_events():
-            self.ball.move(self.board, self.player1, self.player2)
+            now = time.monotonic()
+            accumulator += now - previous
+            previous = now
+            steps = min(int(accumulator // self.PHYSICS_DT), self.MAX_STEPS)
+            # The remainder carries over to the next frame; time past the cap is dropped.
+            accumulator = min(accumulator - steps * self.PHYSICS_DT, self.PHYSICS_DT)
+            for _ in range(steps):
+                self.physics_step()
+
+            # A frame without a step just draws the last state again.
+
             self.board.draw(
                 self.ball,
                 self.player1,
                 self.player2,
                 self.judge,
             )
-            self.ai.move()
-            self.player1.move_smooth()
             self.fps_clock.tick(30)
 
+    def physics_step(self):
+        """
+        Advances the ball and the rackets by one time step.
+        """
+        self.ball.move(self.grid, *self.rackets)
+        # Scoring has to see every step, or a goal can be bounced back by the next one.
+        self.judge.update_score(self.board.width)
+        self.move_rackets()
+
+    def move_rackets(self):
+        """
+        Moves the rackets and re-buckets them in the spatial hash.
+        """
+        old_rects = [racket.rect.copy() for racket in self.rackets]
+        self.ai.move()
+        self.player1.move_smooth()
+        for index, racket in enumerate(self.rackets):
+            self.grid.update(index, old_rects[index], racket.rect)
 
     def handle_events(self):
         """
@@ -72,52 +131,112 @@ class PongGame(object):
         :return True if pygame passed a quit event
         """
 
-        for event in pygame.event.get():
-            if event.type == pygame.locals.QUIT:
+        # poll() does not build a list, which matters since most frames have no events.
+        while True:
+            event = pygame.event.poll()
+            if event.type == pygame.NOEVENT:
+                break
+
+            if event.type == pygame.QUIT:
                 pygame.quit()
                 return True   
 
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_DOWN:
-                    self.player1.max_speed += 7
-                if event.key == pygame.K_UP:
-                    self.player1.max_speed -= 7
-
-            if event.type == pygame.KEYUP:
-                if event.key == pygame.K_DOWN:
-                    self.player1.max_speed -= 7
-                if event.key == pygame.K_UP:
-                    self.player1.max_speed += 7
-                
-            # Mouse control
-            # if event.type == pygame.locals.MOUSEMOTION:
-            #     x, y = event.pos
-            #     self.player1.move(y) 
-            
-            
+            elif event.type in (pygame.KEYDOWN, pygame.KEYUP):
+                sign = 1 if event.type == pygame.KEYDOWN else -1
+                self.player1.max_speed += self.KEY_DELTA.get(event.key, 0) * sign
+
+
+class SpatialHash(object):
+    """
+    Uniform grid that buckets objects by the cells their rect covers, so
+    collision candidates can be found without checking every object.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.buckets = {}
+
+    def _cell_coords_for_object(self, x1, y1, x2, y2):
+        """
+        Returns the coordinates of all the cells covered by the given box.
+        """
+        cell_size = self.cell_size
+        return [
+            (i, j)
+            for i in range(x1 // cell_size, x2 // cell_size + 1)
+            for j in range(y1 // cell_size, y2 // cell_size + 1)
+        ]
+
+    def _cells_for_rect(self, rect):
+        return self._cell_coords_for_object(rect.left, rect.top, rect.right, rect.bottom)
+
+    def add(self, index, rect):
+        """
+        Puts the object into every bucket its rect covers.
+        """
+        for cell in self._cells_for_rect(rect):
+            self.buckets.setdefault(cell, set()).add(index)
+
+    def remove(self, index, rect):
+        """
+        Takes the object out of every bucket its rect covers.
+        """
+        for cell in self._cells_for_rect(rect):
+            bucket = self.buckets.get(cell)
+            if bucket is not None:
+                bucket.discard(index)
+                if not bucket:
+                    del self.buckets[cell]
+
+    def update(self, index, old_rect, new_rect):
+        """
+        Re-buckets the object after it moved, if it changed cells.
+        """
+        if self._cells_for_rect(old_rect) == self._cells_for_rect(new_rect):
+            return
+        self.remove(index, old_rect)
+        self.add(index, new_rect)
+
+    def query(self, rect):
+        """
+        Returns the indices of the objects sharing a cell with the rect.
+        """
+        found = set()
+        for cell in self._cells_for_rect(rect):
+            found.update(self.buckets.get(cell, ()))
+        return found
 
 
 class Drawable(object):
     """
     Base class for drawn objects.
     """
-    def __init__(self, width, height, x, y, color=(0, 255, 0)):
+    def __init__(self, width, height, x, y, color=(0, 255, 0), alpha=True):
         self.width = width
         self.height = height
         self.color = color
-        self.surface = pygame.Surface([width, height], pygame.SRCALPHA, 32).convert_alpha()
+        if alpha:
+            self.surface = pygame.Surface([width, height], pygame.SRCALPHA, 32).convert_alpha()
+        else:
+            # Opaque surfaces take SDL's plain blitter, without per-pixel alpha.
+            self.surface = pygame.Surface([width, height]).convert()
         self.rect = self.surface.get_rect(x=x, y=y)
+        # The rect is only ever moved in place, so the pair stays current.
+        self.blit_pair = (self.surface, self.rect)
 
     def draw_on(self, surface):
-        surface.blit(self.surface, self.rect)
+        return surface.blit(self.surface, self.rect)
 
 
 class Ball(Drawable):
     """
     The ball itself controls its speed and the direction of movement.
     """
-    def __init__(self, width, height, x, y, color=(255, 0, 0), x_speed=5, y_speed=5):
-        super(Ball, self).__init__(width, height, x, y, color)
+    def __init__(self, board, width, height, x, y, color=(255, 0, 0), x_speed=5, y_speed=5):
+        super(Ball, self).__init__(width, height, x, y, color, alpha=True)
+        # Bounce thresholds, the board does not change size during the game.
+        self.x_max = board.width - self.width
+        self.y_max = board.height - self.height
         pygame.draw.ellipse(self.surface, self.color, [0, 0, self.width, self.height])
         self.x_speed = x_speed
         self.y_speed = y_speed
@@ -144,22 +263,25 @@ class Ball(Drawable):
         self.rect.x, self.rect.y = self.start_x, self.start_y
         self.bounce_y()
 
-    def move(self, board, *args):
+    def move(self, grid, *args):
         """
         Moves the ball by the velocity vector.
-        """
-        self.rect.x += self.x_speed
-        self.rect.y += self.y_speed
 
-        if self.rect.x <= 0 or self.rect.x >= board.surface.get_width()-self.width:
-            self.bounce_x()
-        
-        if self.rect.y <= 0 or self.rect.y >= board.surface.get_height()-self.height:
-            self.bounce_y()
+        :param grid: spatial hash holding the indices of the rackets
+        :param args: rackets, in the order they were added to the grid
+        """
+        self.rect.move_ip(self.x_speed, self.y_speed)
 
-        for racket in args:
-            if self.rect.colliderect(racket.rect):
-                self.bounce_x()
+        # Bounces are folded in as sign flips, 1 - 2*hit is -1 on a hit.
+        x_hit = (self.rect.x <= 0) | (self.rect.x >= self.x_max)
+        y_hit = (self.rect.y <= 0) | (self.rect.y >= self.y_max)
+        bx, by, bw, bh = self.rect
+        paddle_hit = False
+        for index in grid.query(self.rect):
+            rx, ry, rw, rh = args[index].rect
+            paddle_hit |= (bx < rx + rw) & (bx + bw > rx) & (by < ry + rh) & (by + bh > ry)
+        self.x_speed *= (1 - 2 * x_hit) * (1 - 2 * paddle_hit)
+        self.y_speed *= 1 - 2 * y_hit
 
 
 class Racket(Drawable):
@@ -167,8 +289,9 @@ class Racket(Drawable):
     Racket, it moves on the Y axis with a speed limit.
     """
 
-    def __init__(self, width, height, x, y, color=(0,255, 0), max_speed=0):
-        super(Racket, self).__init__(width, height, x, y, color)
+    def __init__(self, board, width, height, x, y, color=(0,255, 0), max_speed=0):
+        super(Racket, self).__init__(width, height, x, y, color, alpha=False)
+        self.board = board
         self.max_speed = max_speed
         self.surface.fill(color)
 
@@ -182,19 +305,16 @@ class Racket(Drawable):
         self.rect.y += delta
 
     def move_smooth(self):
-        if self.rect.top <= 0:
-            self.rect.top = 0
-        if self.rect.bottom >= pygame.display.get_window_size()[1]:
-            self.rect.bottom = pygame.display.get_window_size()[1]
-
         self.rect.y += self.max_speed
+        self.rect.clamp_ip(self.board.rect)
 
 
 class Ai(object):
     """
     The opponent controls his racket on the basis of observing the bll.
     """
-    def __init__(self, racket, ball):
+    def __init__(self, board, racket, ball):
+        self.board = board
         self.ball = ball
         self.racket = racket
 
@@ -202,12 +322,7 @@ class Ai(object):
         y = self.ball.rect.centery
 
         self.racket.move(y)
-
-        if self.racket.rect.top <= 0:
-            self.racket.rect.top = 0
-        if self.racket.rect.bottom >= pygame.display.get_window_size()[1]:
-            self.racket.rect.bottom = pygame.display.get_window_size()[1]
-        
+        self.racket.rect.clamp_ip(self.board.rect)
 
 
 class Judge(object):
@@ -224,6 +339,12 @@ class Judge(object):
         pygame.font.init()
         font_path = pygame.font.match_font('arial')
         self.font = pygame.font.Font(font_path, 64)
+        # Glyph atlas: the labels and digits are rasterized only once.
+        color = (150, 150, 150)
+        self.labels = [self.font.render(label, True, color) for label in ("Player: ", "Computer: ")]
+        self.digits = [self.font.render(str(digit), True, color) for digit in range(10)]
+        self._cached = None
+        self._cached_score = None
 
     def update_score(self, board_width):
         """
@@ -236,25 +357,41 @@ class Judge(object):
             self.score[1] += 1
             self.ball.reset()
 
-    def draw_text(self, surface, text, x, y):
+    def render_text(self, label, value, x, y):
         """
-        Draws the indicated text in the correct place.
+        Puts together the label and the digits of the value from the glyph atlas
+        and places the text in the correct place.
+
+        :return (surface, rect) pair ready to be blitted
         """
-        text = self.font.render(text, True, (150, 150, 150))
+        parts = [self.labels[label]] + [self.digits[int(digit)] for digit in str(value)]
+        size = sum(part.get_width() for part in parts), max(part.get_height() for part in parts)
+        text = pygame.Surface(size, pygame.SRCALPHA, 32).convert_alpha()
+        x_offset = 0
+        for part in parts:
+            # Copy the glyph pixels as they are, the text surface starts fully transparent.
+            text.blit(part, (x_offset, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            x_offset += part.get_width()
         rect = text.get_rect()
         rect.center = x, y
-        surface.blit(text, rect)
+        return text, rect
 
     def draw_on(self, surface):
         """
-        Updates and draws the results.
-        """
-        width = self.board.surface.get_width()
-        self.update_score(width)
+        Draws the results. The text is put together again only when the
+        score changes.
 
-        height = self.board.surface.get_height()
-        self.draw_text(surface, "Player: {}".format(self.score[0]), width/2, height * 0.3)
-        self.draw_text(surface, "Computer: {}".format(self.score[1]), width/2, height * 0.7)
+        :return list of the areas that were drawn
+        """
+        if self.score != self._cached_score:
+            width, height = self.board.width, self.board.height
+            self._cached = [
+                self.render_text(0, self.score[0], width//2, height * 3 // 10),
+                self.render_text(1, self.score[1], width//2, height * 7 // 10),
+            ]
+            self._cached_score = list(self.score)
+
+        return surface.blits(self._cached)
 
 if __name__ == "__main__":
     game = PongGame(800, 500)